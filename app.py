@@ -1,84 +1,397 @@
-import os, json, hashlib, logging
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+import os, io, re, json, hashlib, logging, asyncio, functools, uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Set, Tuple
 
-import requests
+import httpx
+import numpy as np
+import orjson
+import xxhash
+import pandas as pd
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, model_validator
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from prometheus_client import CollectorRegistry, Counter, Histogram, make_asgi_app, multiprocess
 
-app = FastAPI(title="AidMate Crisis Fetcher")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    if http_client.is_closed:   # a previous shutdown closed it; startups must be repeatable
+        http_client = _new_http_client()
+    if SCHEDULE_PULLS:
+        schedule_pulls()
+    yield
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    await http_client.aclose()
+
+app = FastAPI(title="AidMate Crisis Fetcher", default_response_class=ORJSONResponse, lifespan=lifespan)
 logging.basicConfig(level=logging.INFO)
+# httpx logs every request URL at INFO; FIRMS/AirNow keys live in the URL, so keep those lines out of the logs
+logging.getLogger("httpx").setLevel(logging.WARNING)
 UTC = timezone.utc
 
 # --- Config via env ---
 INGEST_URL = os.environ.get("INGEST_URL")                   # your existing FastAPI /ingest JSON endpoint
+INGEST_FORMAT = os.environ.get("INGEST_FORMAT", "json")     # "json" (one list body) or "ndjson" (streamed, one chunk per line)
 NWS_ALERTS_URL = "https://api.weather.gov/alerts"
 USGS_GEOJSON_HOURLY = "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_hour.geojson"
 NHC_CURRENT = "https://www.nhc.noaa.gov/CurrentStorms.json"
 FIRMS_API_KEY = os.environ.get("FIRMS_API_KEY", "")         # NASA FIRMS MAP_KEY
+# VIIRS_NOAA20_NRT country CSV has a fixed schema: pin the columns/dtypes we read instead of probing each response
+FIRMS_COLS = ("latitude", "longitude", "confidence")
+FIRMS_DTYPES = dict.fromkeys(FIRMS_COLS, str)   # coordinates are converted after the read so one bad cell drops one row
 AIRNOW_KEY = os.environ.get("AIRNOW_KEY", "")               # AirNow API key
+REDIS_URL = os.environ.get("REDIS_URL")                     # optional; upstream caching is off when unset
 
 DEFAULT_STATES = (os.environ.get("STATES", "CT,NJ,NY,MA,PA")).split(",")
+# "lat,lon;lat,lon" AirNow monitoring points, used when a pull doesn't pass air_points
+DEFAULT_AIR_POINTS = [tuple(map(float, p.split(","))) for p in os.environ.get("AIR_POINTS", "").split(";") if p.strip()]
+SCHEDULE_PULLS = os.environ.get("SCHEDULE_PULLS", "").lower() in ("1", "true", "yes")   # poll in-process instead of via /cron/pull
+
+# NWS event types (api.weather.gov/alerts/types) that map to a specific crisis, keyed case-insensitively
+EVENT_TO_CRISIS = {k.casefold(): v for k, v in {
+    **dict.fromkeys((
+        "Hurricane Warning", "Hurricane Watch", "Hurricane Local Statement",
+        "Hurricane Force Wind Warning", "Hurricane Force Wind Watch",
+        "Tropical Storm Warning", "Tropical Storm Watch", "Tropical Storm Local Statement",
+        "Tropical Depression Local Statement",
+    ), "hurricane"),
+    **dict.fromkeys((
+        "Flood Warning", "Flood Watch", "Flood Advisory", "Flood Statement",
+        "Flash Flood Warning", "Flash Flood Watch", "Flash Flood Statement",
+        "Coastal Flood Warning", "Coastal Flood Watch", "Coastal Flood Advisory", "Coastal Flood Statement",
+        "Lakeshore Flood Warning", "Lakeshore Flood Watch", "Lakeshore Flood Advisory", "Lakeshore Flood Statement",
+        "Arroyo and Small Stream Flood Advisory", "Small Stream Flood Advisory",
+        "Urban and Small Stream Flood Advisory",
+    ), "flood"),
+}.items()}
+
+@functools.lru_cache(maxsize=512)
+def crisis_for_event(event: str) -> str:
+    key = event.casefold()
+    if key in EVENT_TO_CRISIS:
+        return EVENT_TO_CRISIS[key]
+    # Unlisted / legacy product names: whole-word match, so "Floodlight ..." isn't a flood
+    words = set(re.findall(r"[a-z]+", key))
+    if words & {"hurricane", "tropical"}:
+        return "hurricane"
+    if "flood" in words:
+        return "flood"
+    return "severe_weather"
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRY_AFTER_CAP = 30   # seconds; longer Retry-After hints are clamped so a pull can't hang on one upstream
+
+def _retry_after(response: httpx.Response) -> float:
+    # Retry-After is either delta-seconds or an HTTP date
+    value = response.headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds()
+        except (TypeError, ValueError):
+            return 0.0
+    return min(max(delay, 0.0), RETRY_AFTER_CAP)
+
+class RetryTransport(httpx.AsyncHTTPTransport):
+    """Retry GETs on timeouts, network errors and 429/5xx with exponential backoff (0.5s, 1s, 2s).
+
+    When the upstream sends Retry-After (typical on 429/503) we wait at least that long, capped at RETRY_AFTER_CAP.
+    """
+
+    def __init__(self, total: int = 3, backoff_factor: float = 0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.total = total
+        self.backoff_factor = backoff_factor
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.total + 1):
+            last = request.method != "GET" or attempt == self.total   # never replay ingest POSTs
+            delay = self.backoff_factor * 2 ** attempt
+            try:
+                response = await super().handle_async_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                if last:
+                    raise
+                logging.warning(f"{request.method} {request.url.host} failed ({type(e).__name__}), retrying")
+            else:
+                if last or response.status_code not in RETRY_STATUS:
+                    return response
+                await response.aclose()
+                delay = max(delay, _retry_after(response))
+                logging.warning(f"{request.method} {request.url.host} returned {response.status_code}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+# One pooled client shared by every puller (keep-alive across /cron/pull calls)
+def _new_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=RetryTransport(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)),
+        timeout=25, headers={"User-Agent": "AidMate/1.0"},
+    )
+
+http_client = _new_http_client()
+redis = Redis.from_url(REDIS_URL) if REDIS_URL else None
 
 def _now_iso() -> str:
     return datetime.now(UTC).isoformat()
 
+def _describe(e: BaseException) -> str:
+    # Safe-to-log summary: httpx errors embed the full URL (and with it FIRMS/AirNow API keys)
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"{e.request.url.host} returned {e.response.status_code}"
+    if isinstance(e, httpx.RequestError):
+        try:
+            return f"{type(e).__name__} contacting {e.request.url.host}"
+        except RuntimeError:   # no request attached
+            return type(e).__name__
+    return f"{type(e).__name__}: {e}"
+
+def _json(r: httpx.Response) -> Any:
+    # orjson decodes straight from the response bytes, several times faster than stdlib json
+    return orjson.loads(r.content)
+
+@functools.lru_cache(maxsize=4096)   # ids repeat across polls (same alert URLs, storms, stations)
 def sha16(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()[:16]
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=8).hexdigest()
 
-def post_chunks(chunks: List[Dict[str, Any]]):
-    if not INGEST_URL:
-        raise RuntimeError("INGEST_URL is not set.")
-    # Expect your ingest endpoint to accept a JSON list of chunks
-    r = requests.post(INGEST_URL, json=chunks, timeout=60)
+# Per-source wall time of the upstream call (cache hits excluded) plus the ingest POST
+PULL_LATENCY = Histogram("aidmate_pull_seconds", "Upstream/ingest call latency", ["source"],
+                         buckets=(.05, .1, .25, .5, 1, 2, 5, 10, 30))
+PULL_ERRORS = Counter("aidmate_pull_errors", "Upstream/ingest calls that raised", ["source"])
+
+def instrumented(source: str):
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with PULL_LATENCY.labels(source=source).time():
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    PULL_ERRORS.labels(source=source).inc()
+                    raise
+        return wrapper
+    return deco
+
+class PartialChunks(list):
+    """Chunks from a pull where some upstream requests failed: returned to the caller, never cached."""
+
+def cached(ttl_seconds: int):
+    """Cache a puller's chunks in Redis for ttl_seconds, keyed on puller name + args.
+
+    The last good body is also kept in a hash ({generated_at, stale_at, body}) and served
+    when the upstream fetch raises, so a flaky feed degrades to stale data instead of failing.
+    Empty and partial (PartialChunks) results are never cached, so they can't pin a blank or
+    incomplete feed for a whole TTL or overwrite the last good body.
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(client: httpx.AsyncClient, *args, **kwargs):
+            if redis is None:
+                return await fn(client, *args, **kwargs)
+            key = "aidmate:" + sha16(fn.__name__ + json.dumps([args, sorted(kwargs.items())], default=str))
+            try:
+                hit = await redis.get(key)
+            except RedisError as e:
+                logging.warning(f"Redis GET failed for {fn.__name__}: {e}")
+                return await fn(client, *args, **kwargs)
+            if hit is not None:
+                return orjson.loads(hit)
+            try:
+                out = await fn(client, *args, **kwargs)
+            except Exception as e:
+                try:
+                    stale = await redis.hget(f"{key}:last", "body")
+                except RedisError as re:
+                    logging.warning(f"Redis HGET failed for {fn.__name__}: {re}")
+                    raise e
+                if stale is None:
+                    raise
+                logging.warning(f"{fn.__name__} failed ({_describe(e)}); serving stale cache")
+                return orjson.loads(stale)
+            if not out or isinstance(out, PartialChunks):
+                return out
+            body = orjson.dumps(out)
+            now = datetime.now(UTC)
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.setex(key, ttl_seconds, body)
+                    pipe.hset(f"{key}:last", mapping={
+                        "generated_at": now.isoformat(),
+                        "stale_at": (now + timedelta(seconds=ttl_seconds)).isoformat(),
+                        "body": body,
+                    })
+                    pipe.expire(f"{key}:last", 86400)
+                    await pipe.execute()
+            except RedisError as e:
+                logging.warning(f"Redis cache write failed for {fn.__name__}: {e}")
+            return out
+        return wrapper
+    return deco
+
+async def _conditional_get(client: httpx.AsyncClient, url: str, key: str, **kwargs):
+    """GET url revalidating against the ETag/Last-Modified stored under key.
+
+    Returns (response, chunks): on 304 chunks are the ones parsed from the last 200, else None.
+    Validators are only sent when we still hold those chunks, so a 304 is always servable.
+    """
+    stored: Dict[bytes, bytes] = {}
+    if redis is not None:
+        try:
+            stored = await redis.hgetall(key)
+        except RedisError as e:
+            logging.warning(f"Redis HGETALL failed for {url}: {e}")
+    headers = {}
+    if b"chunks" in stored:
+        if b"etag" in stored:
+            headers["If-None-Match"] = stored[b"etag"].decode()
+        if b"last_modified" in stored:
+            headers["If-Modified-Since"] = stored[b"last_modified"].decode()
+    r = await client.get(url, headers=headers, **kwargs)
+    if r.status_code == 304 and headers:
+        return r, orjson.loads(stored[b"chunks"])
+    return r, None
+
+async def _store_validators(key: str, r: httpx.Response, chunks: List[Dict[str, Any]]):
+    validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    validators = {k: v for k, v in validators.items() if v}
+    if redis is None or not validators:
+        return
+    try:
+        async with redis.pipeline() as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={**validators, "chunks": orjson.dumps(chunks)})
+            pipe.expire(key, 86400)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Failed to store validators for {r.url.host}: {e}")
+
+SEEN_IDS_KEY = "aidmate:seen_ids"   # sorted set: chunk id -> epoch after which it may be re-sent
+SEEN_MIN_TTL = 86400
+
+def _seen_until(chunk: Dict[str, Any], now: float) -> float:
+    until = now + SEEN_MIN_TTL
+    try:
+        if chunk.get("expires_at"):
+            until = max(until, datetime.fromisoformat(chunk["expires_at"]).timestamp())
+    except (TypeError, ValueError):
+        pass
+    return until
+
+async def _drop_seen(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # One round-trip: prune expired ids, then look up every id in this batch
+    if redis is None:
+        return chunks
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(SEEN_IDS_KEY, "-inf", datetime.now(UTC).timestamp())
+            pipe.zmscore(SEEN_IDS_KEY, [c["id"] for c in chunks])
+            _, scores = await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Dedupe lookup failed, sending all chunks: {e}")
+        return chunks
+    return [c for c, score in zip(chunks, scores) if score is None]
+
+async def _mark_seen(chunks: List[Dict[str, Any]]):
+    if redis is None or not chunks:
+        return
+    now = datetime.now(UTC).timestamp()
+    try:
+        await redis.zadd(SEEN_IDS_KEY, {c["id"]: _seen_until(c, now) for c in chunks})
+    except RedisError as e:
+        logging.warning(f"Failed to record ingested ids: {e}")
+
+@instrumented("ingest")
+async def _send_to_ingest(client: httpx.AsyncClient, chunks: List[Dict[str, Any]]) -> httpx.Response:
+    if INGEST_FORMAT == "ndjson":
+        # Stream one object per line so ingest can start storing before the last chunk is sent
+        async def lines():
+            for c in chunks:
+                yield orjson.dumps(c) + b"\n"
+        r = await client.post(INGEST_URL, content=lines(),
+                              headers={"Content-Type": "application/x-ndjson"}, timeout=60)
+    else:
+        # Expect your ingest endpoint to accept a JSON list of chunks
+        r = await client.post(INGEST_URL, content=orjson.dumps(chunks),
+                              headers={"Content-Type": "application/json"}, timeout=60)
     if r.status_code >= 300:
         raise HTTPException(r.status_code, f"Ingest failed: {r.text}")
-    return r.json() if r.text else {"status": "ok"}
+    return r
+
+async def post_chunks(client: httpx.AsyncClient, chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """POST the chunks ingest hasn't seen yet; returns {sent, skipped, ingest_result}."""
+    if not INGEST_URL:
+        raise RuntimeError("INGEST_URL is not set.")
+    # Active alerts re-appear every poll; only send ids ingest hasn't seen yet
+    fresh = await _drop_seen(chunks)
+    skipped = len(chunks) - len(fresh)
+    if skipped:
+        logging.info(f"Skipping {skipped} already-ingested chunks")
+    if not fresh:
+        return {"sent": 0, "skipped": skipped, "ingest_result": {"status": "ok", "note": "all chunks already ingested"}}
+    r = await _send_to_ingest(client, fresh)
+    await _mark_seen(fresh)
+    return {"sent": len(fresh), "skipped": skipped, "ingest_result": _json(r) if r.content else {"status": "ok"}}
 
 # -------------------- Pullers --------------------
 
-def pull_usgs_earthquakes(min_mag: float = 2.5) -> List[Dict[str, Any]]:
-    r = requests.get(USGS_GEOJSON_HOURLY, timeout=20)
+@cached(ttl_seconds=300)  # hourly feed, refreshed every few minutes
+@instrumented("USGS")
+async def pull_usgs_earthquakes(client: httpx.AsyncClient, min_mag: float = 2.5) -> List[Dict[str, Any]]:
+    key = f"aidmate:cond:{sha16(f'{USGS_GEOJSON_HOURLY}-{min_mag}')}"
+    r, unchanged = await _conditional_get(client, USGS_GEOJSON_HOURLY, key, timeout=20)
+    if unchanged is not None:
+        return unchanged
     r.raise_for_status()
-    data = r.json()
-    out = []
-    for f in data.get("features", []):
-        props = f.get("properties", {})
-        mag = props.get("mag")
-        if mag is None or (min_mag and mag < min_mag):
-            continue
-        place = props.get("place")
-        time_ms = props.get("time")
-        url = props.get("url")
-        lon, lat, depth = f["geometry"]["coordinates"]
-        issued = datetime.fromtimestamp(time_ms/1000, UTC).isoformat()
-        text = (f"M{mag:.1f} earthquake near {place} at {issued} (depth {depth} km). "
-                f"Guidance: Drop, Cover, Hold On. More: {url}")
-        out.append({
-            "id": sha16(f"eq-{time_ms}-{lat}-{lon}"),
-            "crisis": "earthquake",
-            "source": "USGS",
-            "issued_at": issued,
-            "expires_at": None,
-            "region": [place] if place else [],
-            "lat": lat, "lon": lon,
-            "severity": None,
-            "language": "en",
-            "url": url,
-            "text": text
-        })
+    data = _json(r)
+    feats = data.get("features", [])
+    # Filter on a magnitude column in one vectorized pass, then only build records for the survivors
+    mags = np.fromiter((np.nan if (m := f.get("properties", {}).get("mag")) is None else m for f in feats),
+                       dtype="f8", count=len(feats))
+    keep = ~np.isnan(mags)
+    if min_mag:
+        keep &= mags >= min_mag
+    kept = [feats[i] for i in np.flatnonzero(keep)]
+    props = [f.get("properties", {}) for f in kept]
+    coords = [f["geometry"]["coordinates"] for f in kept]
+    issued = [datetime.fromtimestamp(p.get("time")/1000, UTC).isoformat() for p in props]
+    out = [{
+        "id": sha16(f"eq-{p.get('time')}-{lat}-{lon}"),
+        "crisis": "earthquake",
+        "source": "USGS",
+        "issued_at": iss,
+        "expires_at": None,
+        "region": [p.get("place")] if p.get("place") else [],
+        "lat": lat, "lon": lon,
+        "severity": None,
+        "language": "en",
+        "url": p.get("url"),
+        "text": (f"M{p['mag']:.1f} earthquake near {p.get('place')} at {iss} (depth {depth} km). "
+                 f"Guidance: Drop, Cover, Hold On. More: {p.get('url')}")
+    } for p, (lon, lat, depth), iss in zip(props, coords, issued)]
+    await _store_validators(key, r, out)
     return out
 
-def pull_nws_alerts(states: List[str]) -> List[Dict[str, Any]]:
+@cached(ttl_seconds=60)
+@instrumented("NWS")
+async def pull_nws_alerts(client: httpx.AsyncClient, states: List[str]) -> List[Dict[str, Any]]:
     # https://api.weather.gov/alerts
     # Geolocation nuances: zone vs county (see NWS docs) – we fetch state codes directly. :contentReference[oaicite:5]{index=5}
     base_hdr = {"User-Agent": "AidMate/1.0 (contact: aidmate@example.com)"}
     out = []
     # NWS supports comma-separated "area" state codes
     params = {"status": "actual", "active": "true", "limit": 200, "area": ",".join(states)}
-    r = requests.get(NWS_ALERTS_URL, params=params, headers=base_hdr, timeout=25)
+    r = await client.get(NWS_ALERTS_URL, params=params, headers=base_hdr, timeout=25)
     r.raise_for_status()
-    data = r.json()
+    data = _json(r)
     for feat in data.get("features", []):
         p = feat.get("properties", {})
         headline = p.get("headline") or p.get("event")
@@ -88,14 +401,7 @@ def pull_nws_alerts(states: List[str]) -> List[Dict[str, Any]]:
         expires = p.get("expires")
         area_desc = p.get("areaDesc")
         detail = p.get("@id") or p.get("id")
-        event = (p.get("event") or "").lower()
-        # map to crisis
-        if "hurricane" in event or "tropical" in event:
-            crisis = "hurricane"
-        elif "flood" in event:
-            crisis = "flood"
-        else:
-            crisis = "severe_weather"
+        crisis = crisis_for_event(p.get("event") or "")
         text = f"{headline}\nSeverity: {sev}\nArea: {area_desc}\nOnset: {onset}\nExpires: {expires}\n\n{desc}\nMore: {detail}"
         out.append({
             "id": sha16(detail or headline),
@@ -112,15 +418,16 @@ def pull_nws_alerts(states: List[str]) -> List[Dict[str, Any]]:
         })
     return out
 
-def pull_nhc_current() -> List[Dict[str, Any]]:
+@cached(ttl_seconds=300)
+@instrumented("NHC")
+async def pull_nhc_current(client: httpx.AsyncClient) -> List[Dict[str, Any]]:
     # https://www.nhc.noaa.gov/CurrentStorms.json (file spec in PDF) :contentReference[oaicite:6]{index=6}
-    try:
-        r = requests.get(NHC_CURRENT, timeout=20)
-        r.raise_for_status()
-        data = r.json()
-    except Exception as e:
-        logging.warning(f"NHC fetch failed: {e}")
-        return []
+    key = f"aidmate:cond:{sha16(NHC_CURRENT)}"
+    r, unchanged = await _conditional_get(client, NHC_CURRENT, key, timeout=20)
+    if unchanged is not None:
+        return unchanged
+    r.raise_for_status()
+    data = _json(r)
     out = []
     for s in data.get("activeStorms", []):
         name = s.get("name")
@@ -141,50 +448,71 @@ def pull_nhc_current() -> List[Dict[str, Any]]:
             "url": NHC_CURRENT,
             "text": text
         })
+    await _store_validators(key, r, out)
     return out
 
-def pull_firms_us(days: int = 1, limit_rows: int = 200) -> List[Dict[str, Any]]:
+@cached(ttl_seconds=3600)  # daily product
+@instrumented("NASA_FIRMS")
+async def pull_firms_us(client: httpx.AsyncClient, days: int = 1, limit_rows: int = 200) -> List[Dict[str, Any]]:
     # API ref + Python tutorial :contentReference[oaicite:7]{index=7}
     if not FIRMS_API_KEY:
         return []
     url = f"https://firms.modaps.eosdis.nasa.gov/api/country/csv/{FIRMS_API_KEY}/VIIRS_NOAA20_NRT/{days}/USA"
-    r = requests.get(url, timeout=25)
-    out = []
-    if r.status_code == 200 and "latitude" in r.text[:200].lower():
-        lines = r.text.splitlines()
-        header = [h.strip() for h in lines[0].split(",")]
-        ilat = header.index("latitude"); ilon = header.index("longitude")
-        iconf = header.index("confidence") if "confidence" in header else None
-        for row in lines[1:1+limit_rows]:
-            cols = [c.strip() for c in row.split(",")]
-            lat = float(cols[ilat]); lon = float(cols[ilon])
-            conf = cols[iconf] if iconf is not None else "NA"
-            text = f"Active fire detection (VIIRS) at lat {lat:.3f}, lon {lon:.3f}, confidence {conf}."
-            out.append({
-                "id": sha16(f"firms-{lat}-{lon}-{conf}-{days}"),
-                "crisis": "wildfire",
-                "source": "NASA_FIRMS",
-                "issued_at": _now_iso(),
-                "expires_at": None,
-                "region": ["USA"],
-                "lat": lat, "lon": lon,
-                "severity": None,
-                "language": "en",
-                "url": url,
-                "text": text
-            })
-    return out
+    r = await client.get(url, timeout=25)
+    r.raise_for_status()
+    if "latitude" not in r.text[:200].lower():
+        # FIRMS reports bad keys / exceeded quota as a 200 with a plain-text message
+        raise RuntimeError(f"FIRMS returned no CSV: {r.text[:200]}")
+    # C parser does the tokenizing; keep_default_na so a literal "n"/"NA" confidence stays a string
+    try:
+        df = pd.read_csv(io.StringIO(r.text), usecols=FIRMS_COLS, dtype=FIRMS_DTYPES,
+                         nrows=limit_rows, keep_default_na=False)
+    except ValueError as e:   # only usecols can fail here: a pinned column is missing
+        raise RuntimeError(f"FIRMS CSV schema changed, expected columns {FIRMS_COLS}: {e}") from e
+    coords = df[["latitude", "longitude"]].apply(pd.to_numeric, errors="coerce")
+    bad = coords.isna().any(axis=1)
+    if bad.any():
+        logging.warning(f"Dropping {int(bad.sum())} FIRMS rows with unparseable coordinates")
+    df = df.assign(latitude=coords["latitude"], longitude=coords["longitude"])[~bad]
+    if df.empty:   # quiet day: header-only CSV
+        return []
+    # Detections are unique per row (no lru_cache hits), so use the cheaper non-crypto xxh64 (also 16 hex chars)
+    df["id"] = ("firms-" + df["latitude"].astype(str) + "-" + df["longitude"].astype(str)
+                + "-" + df["confidence"] + f"-{days}").map(xxhash.xxh64_hexdigest)
+    df["text"] = ("Active fire detection (VIIRS) at lat " + df["latitude"].map("{:.3f}".format)
+                  + ", lon " + df["longitude"].map("{:.3f}".format) + ", confidence " + df["confidence"] + ".")
+    issued = _now_iso()
+    return [{
+        "id": rec["id"],
+        "crisis": "wildfire",
+        "source": "NASA_FIRMS",
+        "issued_at": issued,
+        "expires_at": None,
+        "region": ["USA"],
+        "lat": rec["latitude"], "lon": rec["longitude"],
+        "severity": None,
+        "language": "en",
+        "url": url,
+        "text": rec["text"]
+    } for rec in df.to_dict("records")]
 
-def pull_airnow(lat: float, lon: float, dist_km: int = 50) -> List[Dict[str, Any]]:
+@cached(ttl_seconds=600)  # hourly observations
+@instrumented("AirNow")
+async def pull_airnow(client: httpx.AsyncClient, points: List[Tuple[float, float]], dist_km: int = 50,
+                     concurrency: int = 8) -> List[Dict[str, Any]]:
     # AirNow current obs by lat/long :contentReference[oaicite:8]{index=8}
-    if not AIRNOW_KEY:
+    if not AIRNOW_KEY or not points:
         return []
     base = "https://www.airnowapi.org/aq/observation/latLong/current/"
-    params = {"format":"application/json","latitude":lat,"longitude":lon,"distance":dist_km,"API_KEY":AIRNOW_KEY}
-    r = requests.get(base, params=params, timeout=20)
-    out = []
-    if r.status_code == 200:
-        for item in r.json():
+    sem = asyncio.Semaphore(concurrency)   # one request per point, at most `concurrency` in flight
+
+    async def one(lat: float, lon: float) -> List[Dict[str, Any]]:
+        params = {"format":"application/json","latitude":lat,"longitude":lon,"distance":dist_km,"API_KEY":AIRNOW_KEY}
+        async with sem:
+            r = await client.get(base, params=params, timeout=20)
+        r.raise_for_status()
+        out = []
+        for item in _json(r):
             txt = (f"Air quality {item['ParameterName']} AQI {item['AQI']} at {item['DateObserved']} "
                    f"{item['HourObserved']}:00 ({item['Category']['Name']}).")
             out.append({
@@ -200,46 +528,180 @@ def pull_airnow(lat: float, lon: float, dist_km: int = 50) -> List[Dict[str, Any
                 "url": base,
                 "text": txt
             })
-    return out
+        return out
+
+    # A bad monitoring point only costs its own readings; fail the call only if every point failed
+    results = await asyncio.gather(*(one(lat, lon) for lat, lon in points), return_exceptions=True)
+    errors = [res for res in results if isinstance(res, BaseException)]
+    if errors and len(errors) == len(results):
+        raise errors[0]   # counted once by @instrumented
+    for (lat, lon), res in zip(points, results):
+        if isinstance(res, BaseException):
+            logging.warning(f"AirNow fetch for {lat},{lon} failed: {_describe(res)}")
+    chunks = [c for res in results if not isinstance(res, BaseException) for c in res]
+    if errors:
+        # Same rule as a total outage: one error per failed pull, and keep the partial batch out of the cache
+        PULL_ERRORS.labels(source="AirNow").inc()
+        return PartialChunks(chunks)
+    return chunks
 
 # -------------------- API Models & endpoint --------------------
 
 class CronParams(BaseModel):
-    states: Optional[List[str]] = None        # e.g., ["CT","NJ"]
+    # Validated by pydantic-core on every /cron/pull; reject typos instead of silently ignoring them
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    states: List[str] = []                    # e.g., ["CT","NJ"]; empty -> STATES env default
     min_mag: float = 2.5
-    air_lat: Optional[float] = None
-    air_lon: Optional[float] = None
+    air_points: List[Tuple[float, float]] = []   # e.g., [[41.76,-72.67],[40.71,-74.01]]; empty -> AIR_POINTS env default
     pull_earthquakes: bool = True
     pull_nws: bool = True
     pull_nhc: bool = True
     pull_firms: bool = True
     pull_airnow: bool = True
 
-@app.get("/health")
-def health():
-    return {"ok": True, "time": _now_iso()}
+    @model_validator(mode="before")
+    @classmethod
+    def _legacy_air_lat_lon(cls, data: Any) -> Any:
+        # Pre-air_points payloads (and scheduler jobs built from the old readme) send air_lat/air_lon.
+        # As before, the point is only used when both are non-zero; explicit air_points win.
+        if isinstance(data, dict) and ("air_lat" in data or "air_lon" in data):
+            data = dict(data)
+            lat, lon = data.pop("air_lat", None), data.pop("air_lon", None)
+            if lat and lon and not data.get("air_points"):
+                data["air_points"] = [(lat, lon)]
+        return data
 
-@app.post("/cron/pull")
-def cron_pull(body: CronParams):
+async def run_pull(body: CronParams) -> Dict[str, Any]:
     states = body.states or DEFAULT_STATES
-    chunks: List[Dict[str, Any]] = []
+    # Upstreams are independent: fire them concurrently, wall time ~ slowest one
+    tasks = []
     if body.pull_earthquakes:
-        chunks += pull_usgs_earthquakes(min_mag=body.min_mag)
+        tasks.append(pull_usgs_earthquakes(http_client, min_mag=body.min_mag))
     if body.pull_nws:
-        chunks += pull_nws_alerts(states)
+        tasks.append(pull_nws_alerts(http_client, states))
     if body.pull_nhc:
-        chunks += pull_nhc_current()
+        tasks.append(pull_nhc_current(http_client))
     if body.pull_firms:
-        chunks += pull_firms_us()
-    if body.pull_airnow and body.air_lat and body.air_lon:
-        chunks += pull_airnow(body.air_lat, body.air_lon)
+        tasks.append(pull_firms_us(http_client))
+    if body.pull_airnow:
+        tasks.append(pull_airnow(http_client, body.air_points or DEFAULT_AIR_POINTS))
+
+    chunks: List[Dict[str, Any]] = []
+    failures = []
+    for res in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(res, BaseException):
+            logging.warning(f"Puller failed: {_describe(res)}")
+            failures.append(_describe(res))
+            continue
+        chunks += res
+    if tasks and len(failures) == len(tasks):
+        # Total upstream outage: surface it as 5xx so the scheduler records a failed run
+        raise HTTPException(502, f"All pullers failed: {'; '.join(failures)}")
 
     if not chunks:
         return {"added": 0, "note": "no chunks produced (check keys/flags)"}
 
     # Send to your existing ingest API
-    # to run in local comment line 242 and 243 and uncomment 245, and do revert it for running in cloud run with scheduler
-    res = post_chunks(chunks)
-    return {"added": len(chunks), "ingest_result": res}
+    # to run in local comment the two lines below and uncomment the preview return, and do revert it for running in cloud run with scheduler
+    res = await post_chunks(http_client, chunks)
+    return {"added": res["sent"], "skipped": res["skipped"], "ingest_result": res["ingest_result"]}
+
+    #return {"added": len(chunks), "chunks": chunks[:2]}  # preview first 2
+
+# -------------------- Background jobs --------------------
+
+# Job state lives in this process (PENDING -> STARTED -> SUCCESS/FAILURE), oldest finished jobs evicted first
+MAX_JOBS = 1000
+jobs: Dict[str, Dict[str, Any]] = {}
+_running: Set[asyncio.Task] = set()   # strong refs so pending tasks aren't garbage-collected
+
+async def _run_job(job_id: str, body: CronParams):
+    job = jobs[job_id]   # submit_pull never evicts unfinished jobs, but hold a ref regardless
+    job["state"] = "STARTED"
+    try:
+        job.update(state="SUCCESS", result=await run_pull(body), finished_at=_now_iso())
+    except Exception as e:
+        logging.error(f"Pull job {job_id} failed: {_describe(e)}", exc_info=not isinstance(e, httpx.HTTPError))
+        job.update(state="FAILURE", error=_describe(e), finished_at=_now_iso())
+
+def submit_pull(body: CronParams) -> str:
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = {"state": "PENDING", "submitted_at": _now_iso()}
+    # Evict oldest finished jobs only; PENDING/STARTED ones are still being written to
+    finished = (jid for jid, job in list(jobs.items()) if job["state"] in ("SUCCESS", "FAILURE"))
+    while len(jobs) > MAX_JOBS and (jid := next(finished, None)) is not None:
+        del jobs[jid]
+    task = asyncio.create_task(_run_job(job_id, body))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return job_id
+
+# -------------------- In-process scheduler --------------------
+
+# Each source polls at its own feed cadence; last run per job is kept for /crons
+scheduler = AsyncIOScheduler(timezone=UTC)
+cron_runs: Dict[str, Dict[str, Any]] = {}
+
+async def _scheduled_pull(name: str, pull):
+    started = _now_iso()
+    try:
+        chunks = await pull()
+        res = await post_chunks(http_client, chunks) if chunks else {"sent": 0, "skipped": 0, "ingest_result": None}
+        cron_runs[name] = {"last_run": started, "status": "ok", "added": res["sent"], "skipped": res["skipped"],
+                           "ingest_result": res["ingest_result"]}
+    except Exception as e:
+        logging.error(f"Scheduled pull {name} failed: {_describe(e)}", exc_info=not isinstance(e, httpx.HTTPError))
+        cron_runs[name] = {"last_run": started, "status": "error", "error": _describe(e)}
+
+def schedule_pulls():
+    # A fresh scheduler per startup: a shut-down AsyncIOScheduler stays bound to the old event loop
+    global scheduler
+    scheduler = AsyncIOScheduler(timezone=UTC)
+    # Each cadence equals the source's @cached TTL, so go through __wrapped__ (instrumented, uncached);
+    # otherwise every other tick would be answered by the entry the previous tick just wrote
+    jobs_by_cron = [
+        ("pull_nws", "* * * * *", lambda: pull_nws_alerts.__wrapped__(http_client, DEFAULT_STATES)),
+        ("pull_usgs", "*/5 * * * *", lambda: pull_usgs_earthquakes.__wrapped__(http_client)),
+        ("pull_airnow", "*/10 * * * *", lambda: pull_airnow.__wrapped__(http_client, DEFAULT_AIR_POINTS)),
+        ("pull_nhc", "*/15 * * * *", lambda: pull_nhc_current.__wrapped__(http_client)),
+        ("pull_firms", "0 * * * *", lambda: pull_firms_us.__wrapped__(http_client)),
+    ]
+    for name, cron, pull in jobs_by_cron:
+        scheduler.add_job(_scheduled_pull, CronTrigger.from_crontab(cron, timezone=UTC), args=[name, pull],
+                          id=name, name=name, max_instances=1, coalesce=True, replace_existing=True)
+    scheduler.start()
+
+def _metrics_app():
+    # Under a forking server (gunicorn -w N) each worker writes to PROMETHEUS_MULTIPROC_DIR; aggregate on scrape
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return make_asgi_app(registry=registry)
+    return make_asgi_app()
+
+app.mount("/metrics", _metrics_app())
+
+@app.get("/health")
+def health():
+    return {"ok": True, "time": _now_iso()}
+
+@app.post("/cron/pull")
+async def cron_pull(body: CronParams, background: bool = Query(False, description="Return a job id and pull in the background")):
+    if background:
+        return {"job_id": submit_pull(body)}
+    return await run_pull(body)
+
+@app.get("/cron/status/{job_id}")
+def cron_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown job id: {job_id}")
+    return {"job_id": job_id, **job}
 
-    #return {"added": len(chunks), "chunks": chunks[:2]}  # preview first 2
\ No newline at end of file
+@app.get("/crons")
+def crons():
+    return [{"name": job.id,
+             "next_run": job.next_run_time.isoformat() if job.next_run_time else None,
+             **cron_runs.get(job.id, {})}
+            for job in scheduler.get_jobs()]